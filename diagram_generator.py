@@ -2,138 +2,386 @@
 
 import subprocess
 import os
+import sys
 import json # Ensure json is imported for potential future uses, though not directly used here
+import hashlib
+import io
+import queue
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import fcntl
+except ImportError: # Not available on Windows
+    fcntl = None
+
+# Opt-in in-process renderer through libgraphviz (no fork/exec or pipes): install
+# pygraphviz (needs libgraphviz-dev to build) and set DIAGRAM_USE_PYGRAPHVIZ=1.
+# It is not part of requirements.txt, so by default diagrams render with `dot`.
+pygraphviz = None
+if os.environ.get("DIAGRAM_USE_PYGRAPHVIZ") == "1":
+    try:
+        import pygraphviz
+    except ImportError:
+        print("Warning: DIAGRAM_USE_PYGRAPHVIZ=1 but pygraphviz is not installed; rendering with 'dot'.")
 
 OUTPUT_DOT_FILENAME = "temp_diagram.dot" # Temporary DOT file
 OUTPUT_IMAGE_FILENAME = "temp_diagram.png" # Temporary PNG file
 
-def generate_graphviz_dot(data: dict) -> str:
+# Rendered images keyed by a hash of the DOT script, so repeat requests skip Graphviz.
+# Set DIAGRAM_CACHE_SIZE=0 to disable the cache.
+DIAGRAM_CACHE_SIZE = int(os.environ.get("DIAGRAM_CACHE_SIZE", "256"))
+DIAGRAM_CACHE_TTL = float(os.environ.get("DIAGRAM_CACHE_TTL", str(4 * 7 * 24 * 3600))) # 4 weeks, in seconds
+
+_render_cache = OrderedDict() # key -> (timestamp, image bytes), oldest first
+_render_cache_lock = threading.Lock()
+
+# Concurrent renders can be coalesced into a single `dot -O` process, like Doxygen's
+# DOT_BATCH_SIZE. The default of 1 renders every script on its own (no batching).
+DIAGRAM_BATCH_SIZE = int(os.environ.get("DIAGRAM_BATCH_SIZE", "1"))
+DIAGRAM_BATCH_WINDOW = float(os.environ.get("DIAGRAM_BATCH_WINDOW_MS", "20")) / 1000 # seconds
+
+# Pipe buffer size for the dot subprocess. PNGs easily exceed the 64 KB Linux default,
+# which costs a scheduling round-trip per 64 KB chunk.
+DOT_PIPE_SIZE = 1 << 20
+F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031) # fcntl only exposes the name from Python 3.10
+
+_render_pool = None # Executor for uncached renders, installed at app startup via set_render_pool()
+_replace_broken_pool = None # Owner's callback: broken executor -> fresh executor
+
+# Node styling by type: (shape, fillcolor, fontcolor)
+_NODE_STYLE = {
+    "server": ("ellipse", "lightskyblue", "black"), # Representing cloud with ellipse
+    "branch": ("box", "coral", "black"),
+    "headquarters": ("box", "darkgray", "white"),
+    "db_management": ("oval", "lightsteelblue", "black"),
+    "database": ("ellipse", "plum", "black"), # Representing cloud with ellipse
+}
+_DEFAULT_NODE_STYLE = ("box", "white", "black")
+_NODE_LABEL_OVERRIDES = {"database": "BD"} # Ensure database label is just "BD"
+
+# Connection styling by type: (color, style, label); a None label keeps the connection's own label
+_EDGE_STYLE = {
+    "sales_report": ("darkgreen", "solid", "Ventas"),
+    "inventory_report": ("darkred", "solid", "Inventario"),
+    "master_data_replication": ("blue", "dashed", "Datos Maestros"),
+    "network": ("darkgreen", "solid", "IP"), # For "IP" connections
+    "local_db_access": ("darkgreen", "solid", ""), # Branch to BD, no label in the original image
+    "management_link": ("darkgreen", "solid", ""), # Yucatan to Gestion BD, no label in the original image
+}
+_DEFAULT_EDGE_STYLE = ("darkgreen", "solid", None) # Default edge color (from original image)
+
+# Escapes for text inside quoted DOT strings, applied with one str.translate call
+_DOT_ESCAPE = str.maketrans({'"': '\\"', '\\': '\\\\', '\n': '\\n'})
+# Node ids: spaces and dashes become underscores, then the usual quoted-string escapes
+_ID_TRANSLATE = str.maketrans({" ": "_", "-": "_", '"': '\\"', '\\': '\\\\', '\n': '\\n'})
+# The footer is an HTML-like label; only quotes have been escaped there historically
+_FOOTER_ESCAPE = str.maketrans({'"': '\\"'})
+
+def _node_emitter(shape: str, fillcolor: str, fontcolor: str, label=None):
+    """
+    Returns a function (graphviz_id, node) -> DOT line with this style baked in.
+    A fixed `label` replaces the node's own name.
+    """
+    line = ('  "{0}" [label="{1}", shape="%s", fillcolor="%s", fontcolor="%s"];\n' % (shape, fillcolor, fontcolor)).format
+    if label is None:
+        return lambda graphviz_id, node: line(graphviz_id, node.name.translate(_DOT_ESCAPE))
+    return lambda graphviz_id, node: line(graphviz_id, label)
+
+def _edge_emitter(color: str, style: str, label=None):
+    """
+    Returns a function (source_id, target_id, conn) -> DOT line with this style baked in.
+    A fixed `label` replaces the connection's own label.
+    """
+    line = ('  "{0}" -> "{1}" [label="{2}", arrowhead="normal", color="%s", style="%s" dir=forward];\n' % (color, style)).format
+    if label is None:
+        return lambda source_id, target_id, conn: line(source_id, target_id, conn.label.translate(_DOT_ESCAPE))
+    return lambda source_id, target_id, conn: line(source_id, target_id, label)
+
+# Type -> emitter maps: one dict lookup and one call per node/connection
+_NODE_EMITTERS = {
+    node_type: _node_emitter(*style, label=_NODE_LABEL_OVERRIDES.get(node_type))
+    for node_type, style in _NODE_STYLE.items()
+}
+_DEFAULT_NODE_EMITTER = _node_emitter(*_DEFAULT_NODE_STYLE)
+_EDGE_EMITTERS = {conn_type: _edge_emitter(*style) for conn_type, style in _EDGE_STYLE.items()}
+_DEFAULT_EDGE_EMITTER = _edge_emitter(*_DEFAULT_EDGE_STYLE)
+
+# Invariant parts of every script, built once instead of per request
+_DOT_HEADER = (
+    'digraph G {\n'
+    '  charset="UTF-8";\n'
+    '  rankdir=TB;\n' # Top to bottom layout
+    '  node [style=filled, fontname="Helvetica", fontsize=10];\n'
+    '  edge [fontname="Helvetica", fontsize=8];\n'
+    '  labeljust="c";\n' # Center the title
+    '  labelloc="t";\n'
+    '  fontsize=20;\n'
+)
+_DOT_FOOTER = (
+    # Force the footer_description node onto the last rank, below every other node.
+    # rank=sink alone does this; no invisible edge to a specific node id is needed.
+    '  subgraph footer_rank { rank=sink; footer_description; }\n'
+    '}\n'
+)
+
+_TITLE_LINE = '  label="{0}";\n'.format
+_FOOTER_NODE_LINE = ('  footer_description [shape=box, style="filled", fillcolor="lavenderblush", '
+                     'color="purple", fontcolor="black", fontsize=10, '
+                     'label=<'
+                     '<TABLE BORDER="0" CELLBORDER="0" CELLSPACING="0">'
+                     '<TR><TD ALIGN="LEFT" WIDTH="500">{0}</TD></TR>' # WIDTH attribute helps with wrapping
+                     '</TABLE>>];\n').format
+
+def generate_graphviz_dot(data) -> str:
     """
-    Generates a Graphviz DOT script from the parsed diagram data,
-    with flexible styling based on node and connection types.
+    Generates a Graphviz DOT script from the parsed diagram data (a DiagramData
+    model, read by attribute), with flexible styling based on node and connection types.
     """
-    dot_commands = ["digraph G {", "  charset=\"UTF-8\";"]
-    dot_commands.append("  rankdir=TB;") # Top to bottom layout
-    dot_commands.append("  node [style=filled, fontname=\"Helvetica\", fontsize=10];")
-    dot_commands.append("  edge [fontname=\"Helvetica\", fontsize=8];")
+    out = io.StringIO()
+    write = out.write
+    write(_DOT_HEADER)
 
     # Main Graph Title at the Top
-    company_name_title = data.get("company_name", "Diagrama de Arquitectura")
-    dot_commands.append(f'  labeljust="c";') # Center the title
-    dot_commands.append(f'  labelloc="t";')
-    dot_commands.append(f'  label="{company_name_title}";')
-    dot_commands.append(f'  fontsize=20;')
+    write(_TITLE_LINE(data.company_name.translate(_DOT_ESCAPE)))
 
     # Define nodes
     node_id_map = {}
-    for node in data["nodes"]:
-        graphviz_id = node["id"].replace(" ", "_").replace("-", "_")
-        node_id_map[node["id"]] = graphviz_id
-
-        label = node['name']
-        shape = "box" # Default shape
-        fillcolor = "white" # Default fill color
-        fontcolor = "black" # Default font color
-
-        # --- Dynamic Styling based on node type ---
-        if node["type"] == "server":
-            shape = "ellipse" # Representing cloud with ellipse
-            fillcolor = "lightskyblue"
-        elif node["type"] == "branch":
-            shape = "box"
-            fillcolor = "coral"
-        elif node["type"] == "headquarters":
-            shape = "box"
-            fillcolor = "darkgray"
-            fontcolor = "white"
-        elif node["type"] == "db_management":
-            shape = "oval"
-            fillcolor = "lightsteelblue"
-        elif node["type"] == "database":
-            shape = "ellipse" # Representing cloud with ellipse
-            fillcolor = "plum"
-            label = "BD" # Ensure label is just "BD"
-
-        dot_commands.append(f'  "{graphviz_id}" [label="{label}", shape="{shape}", fillcolor="{fillcolor}", fontcolor="{fontcolor}"];')
+    for node in data.nodes:
+        graphviz_id = node.id.translate(_ID_TRANSLATE)
+        node_id_map[node.id] = graphviz_id
+        write(_NODE_EMITTERS.get(node.type, _DEFAULT_NODE_EMITTER)(graphviz_id, node))
 
     # Define connections
-    for conn in data["connections"]:
-        source_graphviz_id = node_id_map.get(conn["source_id"])
-        target_graphviz_id = node_id_map.get(conn["target_id"])
+    for conn in data.connections:
+        source_graphviz_id = node_id_map.get(conn.source_id)
+        target_graphviz_id = node_id_map.get(conn.target_id)
 
         if not source_graphviz_id or not target_graphviz_id:
-            print(f"Warning: Node ID not found for connection between '{conn['source_id']}' and '{conn['target_id']}'.")
+            print(f"Warning: Node ID not found for connection between '{conn.source_id}' and '{conn.target_id}'.")
             continue
 
-        edge_label = conn["label"]
-        arrowhead = "normal"
-        color = "darkgreen" # Default edge color (from original image)
-        style = "solid"
-        dir_attr = "dir=forward"
-
-        # --- Dynamic Styling based on connection type ---
-        if conn["type"] == "sales_report":
-            color = "darkgreen"
-            edge_label = "Ventas"
-        elif conn["type"] == "inventory_report":
-            color = "darkred"
-            edge_label = "Inventario"
-        elif conn["type"] == "master_data_replication":
-            color = "blue"
-            style = "dashed"
-            edge_label = "Datos Maestros"
-        elif conn["type"] == "network": # For "IP" connections
-            color = "darkgreen"
-            edge_label = "IP"
-        elif conn["type"] == "local_db_access": # For branch to BD connections
-            color = "darkgreen"
-            edge_label = "" # No label for these in the original image
-        elif conn["type"] == "management_link": # For Yucatan to Gestion BD
-            color = "darkgreen"
-            edge_label = "" # No label for this in the original image
-
-
-        dot_commands.append(f'  "{source_graphviz_id}" -> "{target_graphviz_id}" [label="{edge_label}", arrowhead="{arrowhead}", color="{color}", style="{style}" {dir_attr}];')
+        write(_EDGE_EMITTERS.get(conn.type, _DEFAULT_EDGE_EMITTER)(source_graphviz_id, target_graphviz_id, conn))
 
     # Add the descriptive text at the very bottom, wrapping it within a separate node.
-    footer_text = data.get("general_network_description", "").replace('"', '\\"')
-    dot_commands.append(f'  footer_description [shape=box, style="filled", fillcolor="lavenderblush", '
-                        f'color="purple", fontcolor="black", fontsize=10, '
-                        f'label=<'
-                        f'<TABLE BORDER="0" CELLBORDER="0" CELLSPACING="0">'
-                        f'<TR><TD ALIGN="LEFT" WIDTH="500">{footer_text}</TD></TR>' # WIDTH attribute helps with wrapping
-                        f'</TABLE>>];')
-
-    # Force the footer_description node to the bottom rank
-    dot_commands.append(f'  {{ rank=sink; footer_description; }}')
-    # Add an invisible edge to establish ordering from a bottom node to the footer.
-    # This helps ensure the footer is placed after all other nodes.
-    # We'll use a generic existing node from the bottom row for this.
-    # For robust placement, it might be good to ensure at least one node is placed before it.
-    # For this diagram, "Yucatan_HQ" is a good candidate to connect invisibly.
-    dot_commands.append(f'  Yucatan_HQ -> footer_description [style=invis];')
-
-
-    dot_commands.append("}")
-    return "\n".join(dot_commands)
+    write(_FOOTER_NODE_LINE(data.general_network_description.translate(_FOOTER_ESCAPE)))
+
+    write(_DOT_FOOTER)
+    return out.getvalue()
+
+def _cache_key(dot_script: str, format: str) -> bytes:
+    """
+    Returns the render cache key for a DOT script and output format.
+    """
+    return hashlib.blake2b(dot_script.encode("utf-8"), digest_size=16, person=format.encode("ascii")[:16]).digest()
+
+def get_cached_render(dot_script: str, format: str = "png"):
+    """
+    Returns the cached image bytes for the DOT script, or None if it has not been
+    rendered yet (or the entry expired).
+    """
+    if DIAGRAM_CACHE_SIZE <= 0:
+        return None
+    key = _cache_key(dot_script, format)
+    with _render_cache_lock:
+        entry = _render_cache.get(key)
+        if entry is None:
+            return None
+        timestamp, image_bytes = entry
+        if time.monotonic() - timestamp > DIAGRAM_CACHE_TTL:
+            del _render_cache[key]
+            return None
+        _render_cache.move_to_end(key)
+        return image_bytes
+
+def _store_render(dot_script: str, format: str, image_bytes: bytes) -> None:
+    """
+    Stores rendered image bytes in the cache, evicting the least recently used entries.
+    """
+    if DIAGRAM_CACHE_SIZE <= 0:
+        return
+    key = _cache_key(dot_script, format)
+    with _render_cache_lock:
+        _render_cache[key] = (time.monotonic(), image_bytes)
+        _render_cache.move_to_end(key)
+        while len(_render_cache) > DIAGRAM_CACHE_SIZE:
+            _render_cache.popitem(last=False)
+
+def _grow_pipe(pipe) -> None:
+    """
+    Enlarges a pipe's kernel buffer to DOT_PIPE_SIZE (Linux only, best effort).
+    """
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return
+    try:
+        fcntl.fcntl(pipe.fileno(), F_SETPIPE_SZ, DOT_PIPE_SIZE)
+    except OSError:
+        pass # e.g. above /proc/sys/fs/pipe-max-size; keep the default buffer
+
+def _render_with_dot(dot_script: str, format: str) -> bytes:
+    """
+    Runs a single `dot` process over the DOT script (via stdin) and returns its output.
+    """
+    with subprocess.Popen(
+        ["dot", f"-T{format}"],
+        stdin=subprocess.PIPE, # Pass DOT script via stdin
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    ) as proc:
+        _grow_pipe(proc.stdin)
+        _grow_pipe(proc.stdout)
+        stdout, stderr = proc.communicate(dot_script.encode("utf-8"))
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, proc.args, stdout, stderr)
+    return stdout
+
+def _render_with_pygraphviz(dot_script: str, format: str) -> bytes:
+    """
+    Lays out and renders the DOT script in-process via libgraphviz (gvLayout/gvRender).
+    """
+    graph = pygraphviz.AGraph(string=dot_script)
+    return graph.draw(format=format, prog="dot")
+
+def _render_uncached(dot_script: str, format: str) -> bytes:
+    """
+    Renders with pygraphviz when it is enabled, otherwise with a `dot` subprocess.
+    """
+    if pygraphviz is not None:
+        return _render_with_pygraphviz(dot_script, format)
+    return _render_with_dot(dot_script, format)
+
+class _RenderBatcher:
+    """
+    Collects pending DOT scripts for a short window and renders them with one
+    `dot -O` process, saving a process startup for every extra script in the batch.
+    """
+
+    def __init__(self, batch_size: int, window: float):
+        self.batch_size = batch_size
+        self.window = window
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="dot-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, dot_script: str, format: str) -> Future:
+        future = Future()
+        self._queue.put((dot_script, format, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            jobs_by_format = {}
+            for job in batch:
+                jobs_by_format.setdefault(job[1], []).append(job)
+            for format, jobs in jobs_by_format.items():
+                try:
+                    self._render_batch(format, jobs)
+                except Exception as e:
+                    for _, _, future in jobs:
+                        if not future.done():
+                            future.set_exception(e)
+
+    def _render_batch(self, format: str, jobs: list) -> None:
+        with tempfile.TemporaryDirectory(prefix="dot_batch_") as tmp_dir:
+            dot_paths = []
+            for i, (dot_script, _, _) in enumerate(jobs):
+                dot_path = os.path.join(tmp_dir, f"diagram_{i}.dot")
+                with open(dot_path, "w", encoding="utf-8") as f:
+                    f.write(dot_script)
+                dot_paths.append(dot_path)
+
+            # -O writes each output next to its input as "<input>.<format>"
+            result = subprocess.run(["dot", f"-T{format}", "-O", *dot_paths], capture_output=True)
+
+            if result.returncode != 0:
+                # dot skips scripts it can't parse and may still write a degraded image for
+                # others, so no output of a failed batch can be trusted or tied to the failing
+                # script. Render every job on its own, so each request gets the same result
+                # or CalledProcessError as without batching.
+                for dot_script, _, future in jobs:
+                    try:
+                        future.set_result(_render_with_dot(dot_script, format))
+                    except Exception as e:
+                        future.set_exception(e)
+                return
+
+            for dot_path, (_, _, future) in zip(dot_paths, jobs):
+                with open(f"{dot_path}.{format}", "rb") as f:
+                    future.set_result(f.read())
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+def _get_batcher() -> _RenderBatcher:
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = _RenderBatcher(DIAGRAM_BATCH_SIZE, DIAGRAM_BATCH_WINDOW)
+        return _batcher
+
+def set_render_pool(executor, replace_broken=None) -> None:
+    """
+    Routes uncached renders through `executor` (e.g. a ProcessPoolExecutor created at
+    app startup), so `dot` is spawned from a small pre-forked worker instead of the
+    server process. Pass None to render in the calling thread again.
+
+    `replace_broken(broken_executor)` is called when a worker died and broke the pool;
+    it must return a working executor (and install it here) so the render can be retried.
+    """
+    global _render_pool, _replace_broken_pool
+    _render_pool = executor
+    _replace_broken_pool = replace_broken
+
+def _run_in_render_pool(fn, *args):
+    """
+    Runs fn(*args) in the render pool and waits for the result. If the pool broke
+    (a worker was killed or crashed), retries once on the replacement pool.
+    """
+    pool = _render_pool
+    try:
+        return pool.submit(fn, *args).result()
+    except BrokenProcessPool:
+        if _replace_broken_pool is None:
+            raise
+        print("Warning: render pool is broken (a worker died); retrying on a fresh pool.")
+        return _replace_broken_pool(pool).submit(fn, *args).result()
 
 def render_diagram_to_bytes(dot_script: str, format: str = "png") -> bytes:
     """
     Renders the Graphviz DOT script to an image format and returns the bytes.
-    Does not write to a file directly.
+    Does not write to a file directly. Results are cached by DOT script hash.
     """
+    cached = get_cached_render(dot_script, format)
+    if cached is not None:
+        print("Diagram served from render cache.")
+        return cached
+
     print(f"Attempting to render diagram using Graphviz (format: {format})...")
     try:
-        # Use subprocess.run to execute 'dot' command
-        result = subprocess.run(
-            ["dot", f"-T{format}"],
-            input=dot_script.encode("utf-8"), # Pass DOT script via stdin
-            capture_output=True,
-            check=True,
-            text=False # Crucial: set to False to get bytes output
-        )
+        if pygraphviz is None and DIAGRAM_BATCH_SIZE > 1: # Batching only saves `dot` startups
+            image_bytes = _get_batcher().submit(dot_script, format).result()
+        elif _render_pool is not None:
+            image_bytes = _run_in_render_pool(_render_uncached, dot_script, format)
+        else:
+            image_bytes = _render_uncached(dot_script, format)
         print("Diagram rendered successfully!")
-        return result.stdout
+        _store_render(dot_script, format, image_bytes)
+        return image_bytes
     except FileNotFoundError:
         print("Error: 'dot' command not found. Ensure Graphviz is installed and in PATH.")
         raise
@@ -145,3 +393,9 @@ def render_diagram_to_bytes(dot_script: str, format: str = "png") -> bytes:
     except Exception as e:
         print(f"An unexpected error occurred during diagram rendering: {e}")
         raise
+
+def render_diagram(data, format: str = "png") -> bytes:
+    """
+    Generates and renders the diagram for the parsed diagram data.
+    """
+    return render_diagram_to_bytes(generate_graphviz_dot(data), format)
@@ -1,19 +1,67 @@
 # doc_generator.py
+import copy
+import re
+from xml.sax.saxutils import escape
+from lxml import etree
 from docx import Document
 from docx.shared import Pt, Inches
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
-from docx.oxml.ns import qn # qn might not be strictly needed for basic doc generation
+from docx.opc.phys_pkg import _ZipPkgWriter
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls, qn
+from office_package import use_fast_compression
 
-def create_document_docx(title_text: str, intro_text: str, items: list, table_data: list) -> bytes:
+use_fast_compression(_ZipPkgWriter)
+
+# Font sizes, built once instead of per run
+_PT11 = Pt(11)
+_PT12 = Pt(12)
+
+# Parsed once at import; each request deep-copies it instead of unzipping and
+# parsing python-docx's default.docx template again.
+_BASE_DOC = Document()
+
+_BULLET_P = '<w:p><w:pPr><w:pStyle w:val="%s"/></w:pPr>{}</w:p>' % _BASE_DOC.styles['List Bullet'].style_id
+
+_LINE_BREAKS = re.compile("[\r\n]")
+
+def _run_xml(text: str) -> str:
     """
-    Generates a .docx document based on provided data and returns its bytes.
+    Returns the <w:r> XML for `text`, turning tabs into <w:tab/> and each newline
+    or carriage return into <w:br/> the same way python-docx's Run.text does.
+    """
+    parts = []
+    for i, line in enumerate(_LINE_BREAKS.split(text)):
+        if i:
+            parts.append("<w:br/>")
+        for j, chunk in enumerate(line.split("\t")):
+            if j:
+                parts.append("<w:tab/>")
+            if chunk:
+                parts.append(f'<w:t xml:space="preserve">{escape(chunk)}</w:t>')
+    return "<w:r>" + "".join(parts) + "</w:r>"
+
+def _parse_children(xml: str, what: str) -> list:
+    """
+    Parses a run of sibling WordprocessingML elements in one go and returns them.
     """
-    doc = Document()
+    try:
+        return list(parse_xml(f"<w:body {nsdecls('w')}>{xml}</w:body>"))
+    except etree.XMLSyntaxError as e: # Not picklable, so it can't leave a pool worker as-is
+        raise ValueError(f"{what} contain text that is not valid in XML: {e}") from None
+
+def write_document_docx(target, title_text: str, intro_text: str, items: list, table_rows: list) -> None:
+    """
+    Generates a .docx document based on provided data and saves it to `target`
+    (a file path or a writable binary stream). `table_rows` are sequences of three
+    cell values, one per column.
+    """
+    doc = copy.deepcopy(_BASE_DOC)
 
     # --- Cover Page ---
     doc.add_heading(title_text, level=0)
     p = doc.add_paragraph('Generado automáticamente por StudenTools. ')
-    p.runs[0].font.size = Pt(12)
+    p.runs[0].font.size = _PT12
     doc.add_paragraph() # blank line
 
     # --- Section: Introduction ---
@@ -24,42 +72,49 @@ def create_document_docx(title_text: str, intro_text: str, items: list, table_da
     doc.add_heading('2. Contenido principal', level=1)
     p = doc.add_paragraph()
     run = p.add_run("Texto normal, seguido de ")
-    run.font.size = Pt(11)
+    run.font.size = _PT11
     run = p.add_run("texto en negrita")
     run.bold = True
-    run.font.size = Pt(11)
+    run.font.size = _PT11
     p.add_run(" y ")
     run2 = p.add_run("texto en cursiva.")
     run2.italic = True
-    run2.font.size = Pt(11)
+    run2.font.size = _PT11
 
     # --- Bullet List ---
     doc.add_heading('3. Lista de puntos', level=2)
-    for it in items:
-        doc.add_paragraph(it, style='List Bullet')
+    # Built as one XML fragment and parsed once, instead of a python-docx paragraph per item
+    bullets_xml = "".join(_BULLET_P.format(_run_xml(str(it))) for it in items)
+    body = doc.element.body
+    for bullet_p in _parse_children(bullets_xml, "Bullet points"):
+        body._insert_p(bullet_p)
 
     # --- Table ---
     doc.add_heading('4. Tabla de ejemplo', level=2)
-    table = doc.add_table(rows=1, cols=len(table_data[0] if table_data else 3)) # Dynamically set cols
+    table = doc.add_table(rows=1, cols=3) # Rows always have three values
     hdr_cells = table.rows[0].cells
-    # Assuming first row of table_data is headers, or provide explicit headers
-    if table_data and isinstance(table_data[0], list) and len(table_data[0]) == 3: # Simple header assumption
+    if table_rows:
         hdr_cells[0].text = 'Columna A'
         hdr_cells[1].text = 'Columna B'
         hdr_cells[2].text = 'Columna C'
-        actual_rows = table_data
-    else: # Fallback or if table_data provides headers explicitly
+    else: # Fallback headers for an empty table
         hdr_cells[0].text = 'Header 1'
         hdr_cells[1].text = 'Header 2'
         hdr_cells[2].text = 'Header 3'
-        actual_rows = table_data
-
 
-    for row_data in actual_rows:
-        row_cells = table.add_row().cells
-        for i, val in enumerate(row_data):
-            if i < len(row_cells): # Ensure we don't go out of bounds if rows have fewer columns
-                row_cells[i].text = str(val)
+    # Data rows are built as one XML fragment and parsed once, instead of add_row() and
+    # a python-docx cell lookup per value. Cells copy the grid widths like add_row() does.
+    tbl = table._tbl
+    cell_templates = ['<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="%s"/></w:tcPr><w:p>{}</w:p></w:tc>' % gridCol.get(qn('w:w'))
+                      for gridCol in tbl.tblGrid.gridCol_lst]
+    rows_xml = "".join(
+        "<w:tr>"
+        + "".join(template.format(_run_xml(str(val))) for template, val in zip(cell_templates, row_data))
+        + "</w:tr>"
+        for row_data in table_rows
+    )
+    for tr in _parse_children(rows_xml, "Table rows"):
+        tbl.append(tr)
 
     table.autofit = True
 
@@ -74,9 +129,14 @@ def create_document_docx(title_text: str, intro_text: str, items: list, table_da
     f_p.text = "Documento generado automáticamente • Página "
     f_p.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
 
+    doc.save(target)
+
+def create_document_docx(title_text: str, intro_text: str, items: list, table_rows: list) -> bytes:
+    """
+    Generates a .docx document based on provided data and returns its bytes.
+    """
     # Save to a BytesIO object instead of a file
     from io import BytesIO
     buffer = BytesIO()
-    doc.save(buffer)
-    buffer.seek(0) # Rewind to the beginning of the buffer
-    return buffer.getvalue()
+    write_document_docx(buffer, title_text, intro_text, items, table_rows)
+    return buffer.getvalue() # Whole buffer regardless of position; no rewind needed
@@ -1,18 +1,113 @@
 # main.py
 
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import Response
+from fastapi.responses import FileResponse, Response
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
+import asyncio
 import json
+import os
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import List, Optional
 
 # Import your generator functions
-from diagram_generator import generate_graphviz_dot, render_diagram_to_bytes
-from doc_generator import create_document_docx # New import
-from ppt_generator import create_presentation_pptx # New import
+from diagram_generator import render_diagram, set_render_pool
+from doc_generator import write_document_docx # New import
+from ppt_generator import write_presentation_pptx # New import
 
 app = FastAPI(title="StudenTools Backend Services")
 
+# Pre-forked workers shared by all generators: diagram renders spawn `dot` from them
+# (so the server process never forks per request) and the python-docx/python-pptx
+# builds run there outside the server's GIL.
+GENERATOR_POOL_WORKERS = int(os.environ.get("GENERATOR_POOL_WORKERS", str(os.cpu_count() or 1)))
+executor = None
+executor_lock = threading.Lock() # Guards swapping in a fresh pool after a worker dies
+
+@app.on_event("startup")
+async def start_executor():
+    global executor
+    executor = ProcessPoolExecutor(max_workers=GENERATOR_POOL_WORKERS)
+    set_render_pool(executor, replace_broken_executor)
+
+def replace_broken_executor(broken):
+    """
+    Swaps a broken pool (one of its workers died, e.g. OOM-killed or a native crash)
+    for a fresh one and returns the executor to use. Requests that hit the same broken
+    pool concurrently all get the single replacement.
+    """
+    global executor
+    with executor_lock:
+        if executor is broken:
+            executor = ProcessPoolExecutor(max_workers=GENERATOR_POOL_WORKERS)
+            set_render_pool(executor, replace_broken_executor)
+            broken.shutdown(wait=False)
+        return executor
+
+async def generate_file(suffix: str, fn, *args) -> str:
+    """
+    Runs fn(path, *args) in the shared pool, without blocking the event loop, to save
+    a generated file into a fresh temp file, and returns its path. If the pool broke,
+    it is replaced and the call retried once.
+
+    The temp file is removed if generation fails or the request is cancelled while
+    waiting. On cancellation that happens only once the worker is done with the file,
+    since a worker still running would otherwise recreate it after the removal.
+    """
+    path = _new_output_path(suffix)
+    pool = executor
+    future = None
+    try:
+        try:
+            future = pool.submit(fn, path, *args)
+            await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            print("Warning: generator pool is broken (a worker died); retrying on a fresh pool.")
+            future = replace_broken_executor(pool).submit(fn, path, *args)
+            await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+        future.add_done_callback(lambda _: _remove_file(path))
+        raise
+    except BaseException:
+        _remove_file(path)
+        raise
+    return path
+
+@app.on_event("shutdown")
+async def stop_executor():
+    set_render_pool(None)
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+def _new_output_path(suffix: str) -> str:
+    """
+    Creates an empty temp file for a pool worker to save a generated file into.
+    """
+    fd, path = tempfile.mkstemp(prefix="studentools_", suffix=suffix)
+    os.close(fd)
+    return path
+
+def _remove_file(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+class TempFileResponse(FileResponse):
+    """
+    FileResponse that owns its (temp) file: the file is deleted once the response is
+    done, whether it was sent completely or the send failed part-way.
+    """
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            _remove_file(self.path)
+
 # --- Diagram Generator Models (from previous steps) ---
 class NodeModel(BaseModel):
     id: str
@@ -68,9 +163,8 @@ async def generate_diagram_endpoint(data: DiagramData):
     and returns the image bytes.
     """
     try:
-        diagram_data_dict = data.dict()
-        dot_script = generate_graphviz_dot(diagram_data_dict)
-        image_bytes = render_diagram_to_bytes(dot_script, format="png")
+        # Blocks on the render cache and pool, so run it off the event loop; the model is passed as-is (no .dict() copy)
+        image_bytes = await run_in_threadpool(render_diagram, data, format="png")
         return Response(content=image_bytes, media_type="image/png")
     except FileNotFoundError:
         raise HTTPException(status_code=500, detail="Graphviz 'dot' command not found on server.")
@@ -87,46 +181,51 @@ async def generate_diagram_endpoint(data: DiagramData):
 async def generate_docx_endpoint(data: DocxData):
     """
     Receives data in JSON, generates a .docx document,
-    and returns the document bytes.
+    and streams the document back.
     """
     try:
-        # Convert table_rows Pydantic models to list of lists for doc_generator
-        table_rows_list = [[row.col1, row.col2, row.col3] for row in data.table_rows]
-
-        docx_bytes = create_document_docx(
-            title_text=data.title,
-            intro_text=data.introduction,
-            items=data.bullet_points,
-            table_data=table_rows_list
+        # The worker saves straight to disk, so the document never crosses the pool as bytes
+        output_path = await generate_file(
+            ".docx",
+            write_document_docx,
+            data.title, # title_text
+            data.introduction, # intro_text
+            data.bullet_points, # items
+            # table_rows as plain tuples: they pickle into the pool much faster than models
+            tuple((row.col1, row.col2, row.col3) for row in data.table_rows)
         )
-        # Set Content-Disposition header to suggest a filename
-        headers = {
-            "Content-Disposition": "attachment; filename=generated_document.docx"
-        }
-        return Response(content=docx_bytes, media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document", headers=headers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating DOCX: {e}")
+    # filename sets the Content-Disposition header; the temp file is removed once sent
+    return TempFileResponse(
+        output_path,
+        media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        filename="generated_document.docx"
+    )
 
 # PPTX Generator Endpoint
 @app.post("/generate-pptx/", response_class=Response, summary="Generate PowerPoint Presentation (.pptx)")
 async def generate_pptx_endpoint(data: PptxData):
     """
     Receives data in JSON, generates a .pptx presentation,
-    and returns the presentation bytes.
+    and streams the presentation back.
     """
     try:
-        pptx_bytes = create_presentation_pptx(
-            title_text=data.title,
-            subtitle_text=data.subtitle,
-            agenda_items=data.agenda_items,
-            features_items=data.features_items
+        output_path = await generate_file(
+            ".pptx",
+            write_presentation_pptx,
+            data.title, # title_text
+            data.subtitle, # subtitle_text
+            data.agenda_items, # agenda_items
+            data.features_items # features_items
         )
-        headers = {
-            "Content-Disposition": "attachment; filename=generated_presentation.pptx"
-        }
-        return Response(content=pptx_bytes, media_type="application/vnd.openxmlformats-officedocument.presentationml.presentation", headers=headers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating PPTX: {e}")
+    return TempFileResponse(
+        output_path,
+        media_type="application/vnd.openxmlformats-officedocument.presentationml.presentation",
+        filename="generated_presentation.pptx"
+    )
 
 # --- Example of how to structure the input data for testing DOCX ---
 @app.get("/example-docx-data")
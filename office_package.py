@@ -0,0 +1,17 @@
+# office_package.py
+
+# zlib level for saved .docx/.pptx packages. They are streamed straight back over HTTP,
+# so level 1 trades a slightly larger download for much less deflate CPU than the default 6.
+ZIP_COMPRESSLEVEL = 1
+
+def use_fast_compression(zip_pkg_writer_cls) -> None:
+    """
+    Makes a python-docx or python-pptx `_ZipPkgWriter` write every package part at
+    ZIP_COMPRESSLEVEL. Neither library takes a compression option on save(); both write
+    parts through `_ZipPkgWriter.write(pack_uri, blob)`, so that method is replaced for
+    the whole process.
+    """
+    def write(self, pack_uri, blob):
+        self._zipf.writestr(pack_uri.membername, blob, compresslevel=ZIP_COMPRESSLEVEL)
+
+    zip_pkg_writer_cls.write = write
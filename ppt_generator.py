@@ -1,95 +1,155 @@
 # ppt_generator.py
+import copy
+import re
 from pptx import Presentation
 from pptx.util import Inches, Pt
 from pptx.enum.text import PP_ALIGN
 from pptx.dml.color import RGBColor
 from pptx.enum.shapes import MSO_SHAPE
+from pptx.opc.serialized import _ZipPkgWriter
+from pptx.oxml import parse_xml
+from pptx.oxml.ns import nsdecls
 from io import BytesIO
+from xml.sax.saxutils import escape
+from lxml import etree
+from office_package import use_fast_compression
 
-def create_presentation_pptx(title_text: str, subtitle_text: str, agenda_items: list, features_items: list) -> bytes:
+use_fast_compression(_ZipPkgWriter)
+
+_BASE_PRS = Presentation() # Default template, loaded once; copied per request below
+
+# Lengths, built once instead of per call: font sizes and (left, top, width, height) boxes
+_PT1 = Pt(1)
+_PT14 = Pt(14)
+_PT18 = Pt(18)
+_PT20 = Pt(20)
+_PT28 = Pt(28)
+_PT40 = Pt(40)
+_FEATURES_BOX = (Inches(0.5), Inches(1.0), Inches(4.2), Inches(4.0))
+_VISUAL_BOX = (Inches(5.0), Inches(1.0), Inches(4.0), Inches(3.0))
+
+_AGENDA_P = '<a:p>{}</a:p>'
+_FEATURE_P = '<a:p><a:pPr lvl="1"><a:defRPr sz="%d"/></a:pPr>{}</a:p>' % _PT18.centipoints
+_CLOSING_P = '<a:p><a:pPr><a:defRPr sz="%d"/></a:pPr>{}</a:p>' % _PT14.centipoints
+
+_LINE_BREAKS = re.compile("\n|\v") # \v marks soft line breaks in text pasted from PowerPoint
+_CTRL_CHARS = re.compile(r"([\x00-\x08\x0B-\x1F])")
+
+def _escape_ctrl_chars(text: str) -> str:
     """
-    Generates a .pptx presentation based on provided data and returns its bytes.
+    Replaces control characters that XML can't hold with python-pptx's plain-text
+    escape, e.g. BEL (x07) becomes "_x0007_". Tab and line feed are left alone.
+    """
+    return _CTRL_CHARS.sub(lambda match: "_x%04X_" % ord(match.group(1)), text)
+
+def _runs_xml(text: str) -> str:
     """
-    prs = Presentation()
+    Returns the <a:r> XML for `text`, turning newlines and vertical tabs into <a:br/>
+    and escaping other control characters the same way python-pptx's _Paragraph.text does.
+    """
+    return "<a:br/>".join(
+        f"<a:r><a:t>{escape(_escape_ctrl_chars(line))}</a:t></a:r>" if line else ""
+        for line in _LINE_BREAKS.split(text)
+    )
+
+def _append_paragraphs(text_frame, paragraphs_xml: str) -> None:
+    """
+    Parses a run of <a:p> elements in one go and appends them to the text frame.
+    """
+    try:
+        paragraphs = parse_xml(f"<a:txBody {nsdecls('a')}>{paragraphs_xml}</a:txBody>")
+    except etree.XMLSyntaxError as e: # lxml errors can't be pickled back from a pool worker
+        raise ValueError(f"Items contain text that is not valid in XML: {e}") from None
+    txBody = text_frame._txBody
+    for p in list(paragraphs):
+        txBody.append(p)
+
+# Static contact lines of the closing slide, built once
+_CLOSING_XML = "".join(_CLOSING_P.format(_runs_xml(text)) for text in (
+    "Email: tu.email@ejemplo.com",
+    "¿Quieres que personalice esto con tus colores, logo o contenido?",
+))
+
+def write_presentation_pptx(target, title_text: str, subtitle_text: str, agenda_items: list, features_items: list) -> None:
+    """
+    Generates a .pptx presentation based on provided data and saves it to `target`
+    (a file path or a writable binary stream).
+    """
+    # All per-request text is turned into slide XML up front, so the python-pptx calls
+    # below only assemble shapes that already have their content ready
+    agenda_xml = "".join(_AGENDA_P.format(_runs_xml(item)) for item in agenda_items)
+    features_xml = "".join(_FEATURE_P.format(_runs_xml("• " + item)) for item in features_items)
+
+    prs = copy.deepcopy(_BASE_PRS)
+    slide_layouts = prs.slide_layouts
+    slides = prs.slides
 
     # --- Slide 1: Title slide ---
-    slide_layout = prs.slide_layouts[0]
-    slide = prs.slides.add_slide(slide_layout)
-    title = slide.shapes.title
-    subtitle = slide.placeholders[1]
+    shapes = slides.add_slide(slide_layouts[0]).shapes
+    title = shapes.title
+    subtitle = shapes.placeholders[1]
 
     title.text = title_text
     subtitle.text = subtitle_text
 
-    title_tf = title.text_frame
-    for paragraph in title_tf.paragraphs:
+    for paragraph in title.text_frame.paragraphs:
         for run in paragraph.runs:
-            run.font.size = Pt(40)
+            run.font.size = _PT40
 
     # --- Slide 2: Agenda (bullet points) ---
-    slide_layout = prs.slide_layouts[1]
-    slide = prs.slides.add_slide(slide_layout)
-    slide.shapes.title.text = "Agenda"
+    shapes = slides.add_slide(slide_layouts[1]).shapes
+    shapes.title.text = "Agenda"
 
-    body_tf = slide.shapes.placeholders[1].text_frame
+    body_tf = shapes.placeholders[1].text_frame
     body_tf.clear()
     p = body_tf.paragraphs[0]
     p.text = "Introducción"
     p.level = 0
 
-    for item in agenda_items:
-        p = body_tf.add_paragraph()
-        p.text = item
-        p.level = 0
+    _append_paragraphs(body_tf, agenda_xml)
 
     # --- Slide 3: Two columns (text + visual placeholder) ---
-    slide_layout = prs.slide_layouts[5] # A blank-like layout
-    slide = prs.slides.add_slide(slide_layout)
+    shapes = slides.add_slide(slide_layouts[5]).shapes # A blank-like layout
 
     # Left column: Title + bullets
-    left = slide.shapes.add_textbox(Inches(0.5), Inches(1.0), Inches(4.2), Inches(4.0))
+    left = shapes.add_textbox(*_FEATURES_BOX)
     left_tf = left.text_frame
     left_tf.text = "Características clave"
-    left_tf.paragraphs[0].font.size = Pt(28)
+    left_tf.paragraphs[0].font.size = _PT28
 
-    for item in features_items:
-        p = left_tf.add_paragraph()
-        p.text = "• " + item
-        p.level = 1
-        p.font.size = Pt(18)
+    _append_paragraphs(left_tf, features_xml)
 
     # Right column: "visual" placeholder
-    shape = slide.shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, Inches(5.0), Inches(1.0), Inches(4.0), Inches(3.0))
+    shape = shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, *_VISUAL_BOX)
     fill = shape.fill
     fill.solid()
     fill.fore_color.rgb = RGBColor(232, 242, 255)
     line = shape.line
-    line.width = Pt(1)
+    line.width = _PT1
     shape.text = "Espacio para imagen o gráfico\nPuedes reemplazarlo con tu imagen"
 
-    shape_tf = shape.text_frame
-    shape_tf.paragraphs[0].font.size = Pt(14)
-    shape_tf.paragraphs[0].alignment = PP_ALIGN.CENTER
+    first_p = shape.text_frame.paragraphs[0]
+    first_p.font.size = _PT14
+    first_p.alignment = PP_ALIGN.CENTER
 
     # --- Slide 4: Contact / Close ---
-    slide_layout = prs.slide_layouts[1]
-    slide = prs.slides.add_slide(slide_layout)
-    slide.shapes.title.text = "Cierre y contacto"
+    shapes = slides.add_slide(slide_layouts[1]).shapes
+    shapes.title.text = "Cierre y contacto"
 
-    body_tf = slide.shapes.placeholders[1].text_frame
+    body_tf = shapes.placeholders[1].text_frame
     body_tf.clear()
     p = body_tf.paragraphs[0]
     p.text = "Gracias por tu atención"
-    p.font.size = Pt(20)
-    p = body_tf.add_paragraph()
-    p.text = "Email: tu.email@ejemplo.com"
-    p.font.size = Pt(14)
-    p = body_tf.add_paragraph()
-    p.text = "¿Quieres que personalice esto con tus colores, logo o contenido?"
-    p.font.size = Pt(14)
+    p.font.size = _PT20
+    _append_paragraphs(body_tf, _CLOSING_XML)
 
+    prs.save(target)
+
+def create_presentation_pptx(title_text: str, subtitle_text: str, agenda_items: list, features_items: list) -> bytes:
+    """
+    Generates a .pptx presentation based on provided data and returns its bytes.
+    """
     # Save to a BytesIO object instead of a file
     buffer = BytesIO()
-    prs.save(buffer)
-    buffer.seek(0)
-    return buffer.getvalue()
+    write_presentation_pptx(buffer, title_text, subtitle_text, agenda_items, features_items)
+    return buffer.getvalue() # Whole buffer regardless of position; no rewind needed